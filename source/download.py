@@ -4,15 +4,39 @@ The purpose of this module is to download data from cricsheet.org
 
 import os.path
 import os
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import urllib.request
-import feather
+import shutil
+import pyarrow.feather as feather
 import pandas as pd
 import zipfile
 import re
 import yaml
 import sqlite3
 
+try:
+    from yaml import CSafeLoader as _YLoader
+except ImportError:
+    from yaml import SafeLoader as _YLoader
+
+# Patterns used in loops, compiled once
+_RE_DATE = re.compile(r'(\d{4}-\d{2}-\d{2})')
+_RE_MATCHID = re.compile(r'\d{4}-\d{2}-\d{2}[\\/](\d+)')
+_RE_ZIP_MATCHID = re.compile(r'(\d+)\.yaml$')
+_RE_TRIPLET = re.compile(r'(\d{4}), (\d{1,2}), (\d{1,2})')
+
+# Directories, built once
+_RAW = os.path.join('..', 'data', 'raw')
+_INTERIM = os.path.join('..', 'data', 'interim')
+_SQL = os.path.join('..', 'data', 'sqlite')
+_FEATHER = os.path.join('..', 'data', 'feather')
+_NOTEBOOKS = os.path.join('..', 'notebooks')
+_SOURCE = os.path.join('..', 'source')
+
+
 def folder_setup():
     """
     Create directories if need be
@@ -30,7 +54,7 @@ def get_data_raw_dir():
 
     :return: ../data/raw/
     """
-    return os.path.join('..', 'data', 'raw')
+    return _RAW
 
 
 def get_data_interim_dir(date=None):
@@ -42,8 +66,8 @@ def get_data_interim_dir(date=None):
     :return: ../data/interim or ../data/interim/[date]
     """
     if date is None:
-        return os.path.join('..', 'data', 'interim')
-    return os.path.join('..', 'data', 'interim', date)
+        return _INTERIM
+    return f'{_INTERIM}{os.sep}{date}'
 
 
 def get_data_sql_dir():
@@ -52,7 +76,7 @@ def get_data_sql_dir():
 
     :return: ../data/sqlite/
     """
-    return os.path.join('..', 'data', 'sqlite')
+    return _SQL
 
 
 def get_data_feather_dir():
@@ -61,11 +85,11 @@ def get_data_feather_dir():
 
     :return: ../data/sqlite/
     """
-    return os.path.join('..', 'data', 'feather')
+    return _FEATHER
 
 
 def get_data_raw_filename(date):
-    return os.path.join(get_data_raw_dir(), '{0:s}.zip'.format(date))
+    return f'{_RAW}{os.sep}{date}.zip'
 
 
 def get_notebook_dir():
@@ -74,7 +98,7 @@ def get_notebook_dir():
 
     :return: ../notebooks/
     """
-    return os.path.join('..', 'notebooks')
+    return _NOTEBOOKS
 
 
 def get_source_dir():
@@ -83,7 +107,7 @@ def get_source_dir():
 
     :return: ../source/
     """
-    return os.path.join('..', 'source')
+    return _SOURCE
 
 
 def todays_date():
@@ -103,7 +127,7 @@ def get_new_data_zip_filename():
 
     :return: raw directory / [today's date].zip
     """
-    return os.path.join(get_data_raw_dir(), '{0:s}.zip'.format(todays_date()))
+    return get_data_raw_filename(todays_date())
 
 
 def most_recent_file(directory):
@@ -115,7 +139,8 @@ def most_recent_file(directory):
 
     :return: a file in directory
     """
-    return os.path.join(directory, sorted(os.listdir(directory))[-1])
+    with os.scandir(directory) as it:
+        return os.path.join(directory, max(it, key=lambda e: e.name).name)
 
 
 def most_recent_date(directory):
@@ -126,25 +151,75 @@ def most_recent_date(directory):
 
     :return: str, YYYY-MM-DD
     """
-    fname = most_recent_file(directory)
-    return re.search('(\d{4}-\d{2}-\d{2})', fname).group(0)
+    with os.scandir(directory) as it:
+        fname = max(it, key=lambda e: e.name).name
+    return _RE_DATE.search(fname).group(0)
 
 
-def unzip_to_folder(date=None):
+def unzip_to_folder(date=None, force=False):
     """
-    Extracts files from a zip in raw data to a directory of files in interim.
+    Extracts files from a zip in raw data to a directory of files in interim. Does nothing if a previous call
+    already finished extracting this date's zip and the zip hasn't changed since.
 
     :param date: YYYY-MM-DD, defaults to most recent in raw folder
+    :param force: bool, extract even if already done
 
     :return:
     """
     if date is None:
         date = most_recent_date(get_data_raw_dir())
+    # The zip can be replaced by a later download on the same day, so the marker has to be newer than it
+    done_fname = os.path.join(get_data_interim_dir(date), '.done')
+    if not force and os.path.exists(done_fname) and \
+            os.path.getmtime(done_fname) >= os.path.getmtime(get_data_raw_filename(date)):
+        return
     if not os.path.exists(get_data_interim_dir(date)):
         os.mkdir(get_data_interim_dir(date))
 
-    zfiles = zipfile.ZipFile(get_data_raw_filename(date))
-    zfiles.extractall(path=get_data_interim_dir(date))
+    # Every match is its own deflate stream, and zlib releases the GIL, so members can be inflated in parallel
+    with zipfile.ZipFile(get_data_raw_filename(date)) as zfiles:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            list(ex.map(lambda member: _extract_member(zfiles, member, get_data_interim_dir(date)), zfiles.infolist()))
+    open(done_fname, 'w').close()
+
+
+def _member_target(dest, member):
+    """
+    Works out where ZipFile.extract will write member, cleaning its name the same way (no drive, no .. parts),
+    so the result is always inside dest
+
+    :param dest: str, directory being extracted to
+    :param member: zipfile.ZipInfo
+
+    :return: str
+    """
+    arcname = member.filename.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in ('', os.path.curdir, os.path.pardir))
+    if os.path.sep == '\\':
+        arcname = zipfile.ZipFile._sanitize_windows_name(arcname, os.path.sep)
+    return os.path.normpath(os.path.join(dest, arcname))
+
+
+def _extract_member(zfiles, member, dest):
+    """
+    Thread-safe ZipFile.extract: extract creates missing parent directories with an exists-then-makedirs check,
+    which races between threads, so make them here first with exist_ok
+
+    :param zfiles: zipfile.ZipFile
+    :param member: zipfile.ZipInfo
+    :param dest: str, directory being extracted to
+
+    :return:
+    """
+    target = _member_target(dest, member)
+    if member.is_dir():
+        os.makedirs(target, exist_ok=True)
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    zfiles.extract(member, path=dest)
 
 
 def get_zip_url():
@@ -154,13 +229,20 @@ def get_zip_url():
 
 def save_new_zip():
     """
-    Reads and saves the zip from cricsheet.org
+    Reads and saves the zip from cricsheet.org, streaming it to disk 1MB at a time
     :return:
     """
-    with urllib.request.urlopen(get_zip_url()) as url:
-        page = url.read()
-    with open(get_new_data_zip_filename(), 'wb') as w:
-        w.write(page)
+    # Stream to a temporary file and only move it into place once complete, so a failed download never
+    # leaves a truncated zip for most_recent_date to pick up
+    fname = get_new_data_zip_filename()
+    try:
+        with urllib.request.urlopen(get_zip_url()) as url, open(f'{fname}.part', 'wb') as w:
+            shutil.copyfileobj(url, w, length=1024*1024)
+    except BaseException:
+        if os.path.exists(f'{fname}.part'):
+            os.remove(f'{fname}.part')
+        raise
+    os.replace(f'{fname}.part', fname)
 
 
 def get_sql_db_fname(dbname=None):
@@ -189,87 +271,325 @@ def outcome_table_sql():
     header = 'CREATE TABLE outcome'
     colnames = ['ID', 'winner', 'bytype', 'byamt']
     coltypes = ['TEXT PRIMARY KEY', 'TEXT', 'TEXT', 'INTEGER']
-    cols = ', '.join(['{0:s} {1:s}'.format(cname, ctype) for cname, ctype in zip(colnames, coltypes)])
-    return '{0:s} ({1:s})'.format(header, cols)
+    cols = ', '.join([f'{cname} {ctype}' for cname, ctype in zip(colnames, coltypes)])
+    return f'{header} ({cols})'
+
+
+def connect_sql_db(dbname):
+    """
+    Opens a connection to the given database, set up for fast bulk writes (WAL journal, no fsync per commit)
+
+    :param dbname: str, e.g. matchinfo
+
+    :return: sqlite3.Connection
+    """
+    conn = sqlite3.connect(get_sql_db_fname(dbname))
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-262144')
+    return conn
+
+
+def write_sql_table(conn, tblname, df):
+    """
+    Replaces table tblname with the contents of df (index included) using one executemany. Faster than
+    df.to_sql for large frames. Doesn't commit, so several tables can go in one transaction.
+
+    :param conn: sqlite3.Connection, e.g. from connect_sql_db
+    :param tblname: str
+    :param df: pandas DataFrame
+
+    :return:
+    """
+    df = df.reset_index()
+    sqltypes = {'i': 'INTEGER', 'u': 'INTEGER', 'b': 'INTEGER', 'f': 'REAL'}
+    cols = ', '.join([f'"{cname}" {sqltypes.get(ctype.kind, "TEXT")}' for cname, ctype in zip(df.columns, df.dtypes)])
+    placeholders = ', '.join(['?'] * len(df.columns))
+    # sqlite3 can't bind numpy scalars or NaN, so hand it python objects and None
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+    conn.execute(f'DROP TABLE IF EXISTS "{tblname}"')
+    conn.execute(f'CREATE TABLE "{tblname}" ({cols})')
+    conn.executemany(f'INSERT INTO "{tblname}" VALUES ({placeholders})', rows)
 
 
 def add_to_outcomes(ids, winners=None, bytypes=None, byamts=None):
-    conn = sqlite3.connect(get_sql_db_fname('matchinfo'))
-    c = conn.cursor()
+    """
+    Inserts match outcomes, skipping IDs already in the table. Values are bound as parameters, never formatted
+    into the SQL.
+
+    :param ids: str or list of str
+    :param winners: str or list of str. A single value (including the default None) applies to every ID
+    :param bytypes: str or list of str, e.g. runs or wickets. A single value applies to every ID
+    :param byamts: int or list of int. A single value applies to every ID
 
+    :return:
+    """
     if not isinstance(ids, list):
         ids = [ids]
     if not isinstance(winners, list):
-        winners = [winners]
+        winners = [winners] * len(ids)
     if not isinstance(bytypes, list):
-        bytypes = [bytypes]
+        bytypes = [bytypes] * len(ids)
     if not isinstance(byamts, list):
-        byamts = [byamts]
+        byamts = [byamts] * len(ids)
 
-    for id, winner, bytype, byamt in zip(ids, winners, bytypes, byamts):
-        if winner is None:
-            c.execute("INSERT OR IGNORE INTO outcome (ID) VALUES ({0:s})".format(id))
-        else:
-            c.execute("INSERT OR IGNORE INTO outcome (ID, winner, bytype, byamt) VALUES ({0:s}, {1:s}, {2:s}, {3:d})" \
-                  .format(id, winner, bytype, byamt))
+    rows = list(zip(ids, winners, bytypes, byamts))
+    no_winner_rows = [(id,) for id, winner, _, _ in rows if winner is None]
+    winner_rows = [row for row in rows if row[1] is not None]
+
+    # One transaction for all rows
+    conn = connect_sql_db('matchinfo')
+    c = conn.cursor()
+    conn.execute('BEGIN')
+    c.executemany("INSERT OR IGNORE INTO outcome (ID) VALUES (?)", no_winner_rows)
+    c.executemany("INSERT OR IGNORE INTO outcome (ID, winner, bytype, byamt) VALUES (?, ?, ?, ?)", winner_rows)
     conn.commit()
     conn.close()
 
 
-def aggregate_yaml_to_feather(date=None, limit=None):
+def _yaml_to_rows(yfile, matchid):
+    """
+    Flattens a parsed cricsheet yaml file into rows
+
+    :param yfile: dict, output of yaml.load
+    :param matchid: str
+
+    :return: (matchid, info row as dict, list of innings rows as dicts)
+    """
+    info_row = _flatten(yfile['info'])
+    info_row['ID'] = matchid
+    innings_rows = [_flatten(innings) for innings in yfile['innings']]
+    for row in innings_rows:
+        row['ID'] = matchid
+    return matchid, info_row, innings_rows
+
+
+def _flatten(dct):
+    """
+    Flattens nested dicts into one dict, joining keys with a period, the same way json_normalize would.
+    Lists are left as is (they get split up later, e.g. in edit_and_write_info).
+
+    :param dct: dict
+
+    :return: dict
+    """
+    # Top-level plain values keep their place; nested dicts follow, each flattened depth first,
+    # which is the column order json_normalize gives
+    out = {}
+    nested = []
+    for key, val in dct.items():
+        if isinstance(val, dict):
+            nested.append((key, val))
+        else:
+            out[f'{key}'] = val
+    for key, val in nested:
+        # Stack of (prefix, remaining items) so we can go down into a dict and later pick up where we left off
+        stack = [(f'{key}.', iter(val.items()))]
+        while stack:
+            prefix, items = stack[-1]
+            for k, v in items:
+                if isinstance(v, dict):
+                    stack.append((f'{prefix}{k}.', iter(v.items())))
+                    break
+                out[f'{prefix}{k}'] = v
+            else:
+                stack.pop()
+    return out
+
+
+def _parse_one(file):
+    """
+    Parses a single yaml file from cricsheet. Top-level so it can be sent to worker processes.
+
+    :param file: str, path to a yaml file
+
+    :return: (matchid, info row as dict, list of innings rows as dicts)
+    """
+    # Read the whole (small) file in one go and let the loader decode the bytes itself
+    with open(file, 'rb') as r:
+        yfile = yaml.load(r.read(), Loader=_YLoader)
+
+    # assign an ID--the number part of filename before yaml and after the date
+    matchid = _RE_MATCHID.search(file).group(1)
+
+    return _yaml_to_rows(yfile, matchid)
+
+
+# Each worker process keeps its own handle to the zip rather than reopening it per member
+_open_zips = {}
+
+
+def _parse_zip_member(zip_and_member):
+    """
+    Parses a single yaml file from cricsheet straight out of the zip. Top-level so it can be sent to worker processes.
+
+    :param zip_and_member: (str, str), path to the zip and name of the member inside it
+
+    :return: (matchid, info row as dict, list of innings rows as dicts)
+    """
+    zip_path, member = zip_and_member
+    if zip_path not in _open_zips:
+        _open_zips[zip_path] = zipfile.ZipFile(zip_path)
+    with _open_zips[zip_path].open(member) as r:
+        yfile = yaml.load(r.read(), Loader=_YLoader)
+
+    # assign an ID--the number part of member name before yaml
+    matchid = _RE_ZIP_MATCHID.search(member).group(1)
+
+    return _yaml_to_rows(yfile, matchid)
+
+
+def _parse_in_pool(fun, tasks):
+    """
+    Runs fun over tasks in parallel, one process per core, and collects the results
+
+    :param fun: _parse_one or _parse_zip_member
+    :param tasks: list of arguments for fun
+
+    :return: (list of info rows, list of innings rows)
+    """
+    # Collect plain dicts and build each dataframe once, rather than concatenating thousands of one-row frames
+    info_rows = []
+    innings_rows = []
+    with multiprocessing.Pool(os.cpu_count()) as pool:
+        # Ordered, so the row and column order of the output doesn't depend on which worker finishes first
+        results = pool.imap(fun, tasks, chunksize=32)
+        for i, (matchid, info_row, file_innings_rows) in enumerate(results):
+            info_rows.append(info_row)
+            innings_rows.extend(file_innings_rows)
+            # Printing every file slows the loop down, so only report every 500
+            if (i+1) % 500 == 0 or i+1 == len(tasks):
+                print(f'Done with {i+1}/{len(tasks)}')
+    return info_rows, innings_rows
+
+
+def _write_rows_to_feather(info_rows, innings_rows, date):
+    """
+    Builds the info and innings dataframes and writes them to feather
+
+    :param info_rows: list of dicts
+    :param innings_rows: list of dicts
+    :param date: str, YYYY-MM-DD
+
+    :return:
+    """
+    infodf = pd.DataFrame(info_rows)
+    inningsdf = pd.DataFrame(innings_rows)
+
+    # Lists, dicts, dates etc can't go to feather as is, so stringify every object column in one go
+    for df in [infodf, inningsdf]:
+        obj_cols = df.select_dtypes(include='object').columns
+        df[obj_cols] = df[obj_cols].astype(str)
+        # Teams, venues, umpires etc repeat a lot; categoricals get dictionary-encoded on write
+        rep_cols = [col for col in obj_cols if df[col].nunique() <= len(df) // 2]
+        df[rep_cols] = df[rep_cols].astype('category')
+
+    feather.write_feather(infodf, get_info_dataframe_filename(date), compression='zstd', compression_level=3)
+    feather.write_feather(inningsdf, get_innings_dataframe_filename(date), compression='zstd', compression_level=3)
+
+
+def _write_rows_to_feather_and_mark(info_rows, innings_rows, date, complete):
+    """
+    _write_rows_to_feather, plus a marker file saying whether the feather files hold every match for date
+
+    :param info_rows: list of dicts
+    :param innings_rows: list of dicts
+    :param date: str, YYYY-MM-DD
+    :param complete: bool, False for runs with a limit
+
+    :return:
+    """
+    # Drop the marker first, so a failed write never leaves old output stamped as current
+    if os.path.exists(get_feather_complete_filename(date)):
+        os.remove(get_feather_complete_filename(date))
+    _write_rows_to_feather(info_rows, innings_rows, date)
+    if complete:
+        open(get_feather_complete_filename(date), 'w').close()
+
+
+def _feather_is_current(date):
+    """
+    Checks whether the feather files for date came from a full (not limited) run and are newer than the raw zip
+    they came from
+
+    :param date: str, YYYY-MM-DD
+
+    :return: bool
+    """
+    marker = get_feather_complete_filename(date)
+    fnames = [marker, get_info_dataframe_filename(date), get_innings_dataframe_filename(date)]
+    if not all(os.path.exists(fname) for fname in fnames):
+        return False
+    if not os.path.exists(get_data_raw_filename(date)):
+        return True
+    return os.path.getmtime(marker) >= os.path.getmtime(get_data_raw_filename(date))
+
+
+def aggregate_yaml_to_feather(date=None, limit=None, force=False):
     """
+    Parses every yaml file in the interim folder for date (in parallel, one process per core) and writes the
+    results to feather.
+    Without a limit, does nothing if a previous full run's feather files are already newer than the raw zip.
 
-    :param date:
-    :param limit:
+    :param date: str, YYYY-MM-DD, defaults to most recent in interim folder
+    :param limit: int, parse only this many files
+    :param force: bool, parse even if the feather files are up to date
     :return:
     """
     if date is None:
         date = most_recent_date(get_data_interim_dir())
+    if not force and limit is None and _feather_is_current(date):
+        return
 
     parent = get_data_interim_dir(date)
     files = os.listdir(parent)
 
-    fnames = [os.path.join(parent, file) for file in files]
-    info_dfs = []
-    innings_dfs = []
-    for i, file in enumerate(fnames):
-        with open(file, 'r') as r:
-            yfile = yaml.load(r)
+    # Skip the .done marker from unzip_to_folder, the readme, etc
+    fnames = [os.path.join(parent, file) for file in files if file.endswith('.yaml')]
+    if limit is not None:
+        fnames = fnames[:limit]
 
-            # assign an ID--the number part of filename before yaml and after the date
-            matchid = re.search('\d{4}-\d{2}-\d{2}\\\\(\d+)', file).group(0)[11:]
+    info_rows, innings_rows = _parse_in_pool(_parse_one, fnames)
+    _write_rows_to_feather_and_mark(info_rows, innings_rows, date, limit is None)
 
-            info = pd.io.json.json_normalize(yfile['info']).assign(ID=matchid)
-            innings = pd.io.json.json_normalize(yfile['innings']).assign(ID=matchid)
-            info_dfs.append(info)
-            innings_dfs.append(innings)
 
-        print('Done with {0:d}/{1:d}'.format(i+1, len(fnames)))
-        if limit is not None and i > limit:
-            break
+def aggregate_zip_to_feather(date=None, limit=None, force=False):
+    """
+    Like aggregate_yaml_to_feather, but reads the yaml files straight out of the raw zip, so unzip_to_folder
+    can be skipped.
 
-    infodf = pd.concat(info_dfs)
-    inningsdf = pd.concat(innings_dfs)
+    :param date: str, YYYY-MM-DD, defaults to most recent in raw folder
+    :param limit: int, parse only this many files
+    :param force: bool, parse even if the feather files are up to date
+    :return:
+    """
+    if date is None:
+        date = most_recent_date(get_data_raw_dir())
+    if not force and limit is None and _feather_is_current(date):
+        return
 
-    for col in infodf.columns:
-        if infodf[col].dtype == 'object':
-            infodf.loc[:, col] = infodf[col].astype(str)
-    for col in inningsdf.columns:
-        if inningsdf[col].dtype == 'object':
-            inningsdf.loc[:, col] = inningsdf[col].astype(str)
+    zip_path = get_data_raw_filename(date)
+    with zipfile.ZipFile(zip_path) as zf:
+        members = [info.filename for info in zf.infolist() if info.filename.endswith('.yaml')]
+    if limit is not None:
+        members = members[:limit]
 
-    feather.write_dataframe(infodf, get_info_dataframe_filename(date))
-    feather.write_dataframe(inningsdf, get_innings_dataframe_filename(date))
+    info_rows, innings_rows = _parse_in_pool(_parse_zip_member, [(zip_path, member) for member in members])
+    _write_rows_to_feather_and_mark(info_rows, innings_rows, date, limit is None)
 
 
 def get_info_dataframe_filename(date):
-    return os.path.join(get_data_feather_dir(), '{0:s}_info.feather'.format(date))
+    return f'{_FEATHER}{os.sep}{date}_info.feather'
 def get_info_dataframe(date):
-    return feather.read_dataframe(get_info_dataframe_filename(date))
+    return feather.read_feather(get_info_dataframe_filename(date))
 def get_innings_dataframe_filename(date):
-    return os.path.join(get_data_feather_dir(), '{0:s}_innings.feather'.format(date))
+    return f'{_FEATHER}{os.sep}{date}_innings.feather'
 def get_innings_dataframe(date):
-    return feather.read_dataframe(get_innings_dataframe_filename(date))
+    return feather.read_feather(get_innings_dataframe_filename(date))
+def get_feather_complete_filename(date):
+    return f'{_FEATHER}{os.sep}{date}.complete'
 
 
 def edit_feather_to_sql(date=None):
@@ -282,24 +602,26 @@ def edit_feather_to_sql(date=None):
     # Write to SQL. Every column without a period will be in the main table
     # Columns with a period will be a new table (table name is what comes before the period)
     for df, dbname in [(info, 'matchinfo'), (innings, 'innings')]:
-        period_df = df.filter(regex='\.')
-        no_period_df = df.drop(df.filter(regex='\.').columns, axis=1)
-        conn = sqlite3.connect(get_sql_db_fname(dbname))
-        no_period_df.to_sql(dbname, con=conn, if_exists='replace')
-
-        col_to_table = {}
-        for col in period_df.columns:
-            tname = col[:col.index('.')]
-            if tname not in col_to_table:
-                col_to_table[tname] = []
-            col_to_table[tname].append(col)
-        for tbl in col_to_table:
-            tmp = period_df[col_to_table[tbl]]
-            tmp.to_sql(tbl, con=conn, if_exists='replace')
-
+        period_cols = [col for col in df.columns if '.' in col]
+        no_period_cols = [col for col in df.columns if '.' not in col]
+        period_df = df[period_cols]
+        no_period_df = df[no_period_cols]
+
+        col_to_table = defaultdict(list)
+        for col in period_cols:
+            col_to_table[col[:col.index('.')]].append(col)
+
+        # All tables for a db live in one file, and sqlite allows one writer at a time even with WAL,
+        # so write them one after another in a single transaction
+        conn = connect_sql_db(dbname)
+        conn.execute('BEGIN')
+        write_sql_table(conn, dbname, no_period_df)
+        for tbl, cols in col_to_table.items():
+            write_sql_table(conn, tbl, period_df[cols])
         conn.commit()
         conn.close()
 
+
 def edit_and_write_innings(date):
     return None
 
@@ -312,35 +634,41 @@ def edit_and_write_info(date):
     # Apply to dates, player_of_match, teams, umpires
     # Rows with lists will also be written to different tables
     for col in list_cols_info:
-        vals = info[col].values
         if col == 'dates':
-            vals = [x[1:-1].replace("datetime.date", "") for x in vals]
-            # Split on commas, make sure months and years have zero pads
-            vals = [[re.sub(r'-(\d)-', r'-0\1-', re.sub(r'-(\d)$', r'-0\1', y.replace(', ', '-')))
-                     for y in re.findall(r'\d{4}, \d{2}, \d{1,2}', x)] for x in vals]
+            # Pull out year, month, day from each datetime.date(...), make sure months and days have zero pads
+            ymd = info[col].str.extractall(_RE_TRIPLET)
+            vals = (ymd[0] + '-' + ymd[1].str.zfill(2) + '-' + ymd[2].str.zfill(2)).unstack().reindex(info.index)
         else:
-            vals = [x[1:-1].replace("'", "").split(', ') for x in vals]
+            vals = info[col].str[1:-1].str.replace("'", "", regex=False).str.split(', ', expand=True)
 
-        max_length = max([len(x) for x in vals])
-        newcols = {x: '{0:s}.{1:d}'.format(col[:-1], x+1) for x in range(max_length)}  # :-1 to e.g. turn dates into date
-        for i, newcol in newcols.items():
-            info.loc[:, newcol] = [x[i] if i < len(x) else None for x in vals]
-        info = info.drop(col, axis=1)
+        # :-1 to e.g. turn dates into date
+        vals.columns = [f'{col[:-1]}.{x+1}' for x in range(vals.shape[1])]
+        info = pd.concat([info.drop(col, axis=1), vals], axis=1)
 
     return info
 
 
 def access_dict(dct, *keys):
-    try:
-        if keys is None or len(keys) == 0:
-            return dct
-        return access_dict(dct[keys[0]], keys[1:])
-    except KeyError:
-        return None
-    except ValueError:
-        return None
-    except IndexError:
-        return None
+    """
+    Walks down nested dicts (and lists, for integer keys) without raising
+
+    :param dct: dict
+    :param keys: keys to follow in order
+
+    :return: the value at dct[keys[0]][keys[1]]..., or None if any step is missing
+    """
+    cur = dct
+    for key in keys:
+        if isinstance(cur, dict):
+            cur = cur.get(key)
+        elif isinstance(cur, list) and isinstance(key, int) and -len(cur) <= key < len(cur):
+            cur = cur[key]
+        else:
+            return None
+        if cur is None:
+            return None
+    return cur
+
 
 def download_new_data():
     """
@@ -356,6 +684,7 @@ def download_new_data():
     #save_new_zip()
     #unzip_to_folder()
     #aggregate_yaml_to_feather(limit=20)
+    #aggregate_zip_to_feather(limit=20)  # alternative to the two lines above; reads from the zip directly
     edit_feather_to_sql()
 
 